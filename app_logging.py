@@ -0,0 +1,262 @@
+# ======================================================================
+# ماژول لاگ ساخت‌یافته (Structured Logging) غیرمسدودکننده
+# هندلرها فقط یک رکورد فشرده را در یک صف محدود قرار می‌دهند (بدون I/O روی حلقه رویداد)؛
+# یک Thread پس‌زمینه (QueueListener) رکوردها را به صورت JSON Lines روی stdout می‌نویسد.
+# - زمینه درخواست (chat_id, update_id, stage) به طور خودکار از profiling.current_trace() اضافه می‌شود.
+# - نمونه‌برداری رویدادهای پرحجم: logger.info(..., extra={"sample_rate": 0.01})
+# - خطاهای تکراری یکسان (مثلاً طوفان 429 تلگرام) در هر پنجره زمانی فقط یک بار ثبت می‌شوند
+#   و تعداد تکرارهای سرکوب شده پس از پایان پنجره گزارش می‌شود.
+# ======================================================================
+
+import os
+import sys
+import json
+import time
+import queue
+import random
+import atexit
+import logging
+import threading
+import logging.handlers
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Tuple, List
+
+import profiling
+
+# ثابت‌ها
+LOG_QUEUE_SIZE = 10000
+# پنجره زمانی سرکوب رکوردهای تکراری (ثانیه)
+REPEAT_WINDOW_SECONDS = 10.0
+# رکوردهای هم‌سطح یا بالاتر از این سطح مشمول سرکوب تکرار هستند
+REPEAT_MIN_LEVEL = logging.WARNING
+# حداکثر تعداد کلیدهای متمایز تحت نظر برای سرکوب تکرار
+REPEAT_MAX_KEYS = 1000
+# فاصله بررسی پنجره‌های منقضی شده در Thread نویسنده (ثانیه)
+REPEAT_FLUSH_INTERVAL = 1.0
+
+# فیلدهای استاندارد LogRecord که نباید به عنوان فیلد اضافه در خروجی JSON تکرار شوند
+_RESERVED_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "sample_rate"}
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """سریال‌سازی هر رکورد به یک خط JSON (در Thread نویسنده اجرا می‌شود، نه روی حلقه رویداد)."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry: Dict[str, Any] = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RESERVED_ATTRS and value is not None:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """نگهداری تصادفی رکوردهایی که sample_rate (بین ۰ و ۱) دارند؛ بقیه رکوردها همیشه عبور می‌کنند."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        rate = getattr(record, "sample_rate", None)
+        if rate is None or rate >= 1:
+            return True
+        if random.random() >= rate:
+            return False
+        record.sampled = rate
+        return True
+
+
+_RepeatKey = Tuple[str, int, str, Any, Optional[str]]
+
+
+class RepeatFilter(logging.Filter):
+    """
+    محدودسازی تکرار خطاهای یکسان: از هر (logger, سطح, پیام قالب‌بندی شده, status, نوع استثنا)
+    در هر پنجره زمانی فقط اولین رکورد عبور می‌کند. پس از پایان پنجره، تعداد رکوردهای سرکوب شده
+    توسط Thread نویسنده (expired) گزارش می‌شود، حتی اگر طوفان خطا متوقف شده باشد.
+    filter در Thread فراخوان و expired در Thread نویسنده اجرا می‌شود؛ وضعیت با قفل محافظت می‌شود.
+    """
+
+    def __init__(self, window: float = REPEAT_WINDOW_SECONDS, min_level: int = REPEAT_MIN_LEVEL,
+                 max_keys: int = REPEAT_MAX_KEYS):
+        super().__init__()
+        self.window = window
+        self.min_level = min_level
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        # key -> [شروع پنجره، تعداد سرکوب شده، مشخصات رکورد اول (بدون نگهداری Traceback)]
+        self._seen: "OrderedDict[_RepeatKey, List[Any]]" = OrderedDict()
+        # شمارش‌هایی که باید گزارش شوند ولی کلیدشان به دلیل سقف اندازه حذف شده است
+        self._evicted: List[Tuple[Tuple[Any, ...], int]] = []
+
+    @staticmethod
+    def _key(record: logging.LogRecord) -> _RepeatKey:
+        exc_type = record.exc_info[0].__name__ if record.exc_info and record.exc_info[0] else None
+        return (record.name, record.levelno, record.getMessage(), getattr(record, "status", None), exc_type)
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno < self.min_level:
+            return True
+        key = self._key(record)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._seen.get(key)
+            if entry is not None and now - entry[0] < self.window:
+                entry[1] += 1
+                return False
+            if entry is not None and entry[1]:
+                # پنجره قبلی هنوز توسط Thread نویسنده گزارش نشده است
+                record.repeats_suppressed = entry[1]
+            origin = (record.name, record.levelno, record.pathname, record.lineno, key[2], key[3])
+            self._seen[key] = [now, 0, origin]
+            self._seen.move_to_end(key)
+            while len(self._seen) > self.max_keys:
+                _, (_, suppressed, origin) = self._seen.popitem(last=False)
+                if suppressed:
+                    self._evicted.append((origin, suppressed))
+        return True
+
+    def expired(self) -> List[logging.LogRecord]:
+        """رکوردهای خلاصه برای پنجره‌های منقضی شده‌ای که رکورد سرکوب شده داشته‌اند."""
+        now = time.monotonic()
+        with self._lock:
+            pending, self._evicted = self._evicted, []
+            for key in [k for k, entry in self._seen.items() if now - entry[0] >= self.window]:
+                _, suppressed, origin = self._seen.pop(key)
+                if suppressed:
+                    pending.append((origin, suppressed))
+        return [self._summary(origin, suppressed) for origin, suppressed in pending]
+
+    @staticmethod
+    def _summary(origin: Tuple[Any, ...], suppressed: int) -> logging.LogRecord:
+        name, levelno, pathname, lineno, message, status = origin
+        summary = logging.LogRecord(name, levelno, pathname, lineno,
+                                    "Repeated %d times: %s", (suppressed, message), None)
+        summary.repeats_suppressed = suppressed
+        summary.status = status
+        return summary
+
+    def reset_after_fork(self) -> None:
+        """قفل ممکن است هنگام Fork در اختیار Thread دیگری بوده باشد؛ در فرزند از نو ساخته می‌شود."""
+        self._lock = threading.Lock()
+        self._seen.clear()
+        self._evicted = []
+
+
+class RepeatFlushingListener(logging.handlers.QueueListener):
+    """QueueListener که در زمان بیکاری، خلاصه تکرارهای سرکوب شده را هم می‌نویسد."""
+
+    def __init__(self, log_queue, *handlers, repeat_filter: RepeatFilter, **kwargs):
+        super().__init__(log_queue, *handlers, **kwargs)
+        self.repeat_filter = repeat_filter
+
+    def dequeue(self, block: bool) -> logging.LogRecord:
+        while True:
+            try:
+                return self.queue.get(block, timeout=REPEAT_FLUSH_INTERVAL)
+            except queue.Empty:
+                self.flush_repeats()
+
+    def flush_repeats(self) -> None:
+        for summary in self.repeat_filter.expired():
+            self.handle(summary)
+
+    def stop(self) -> None:
+        super().stop()
+        self.flush_repeats()
+
+
+class ContextQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler با صف محدود: زمینه درخواست را اضافه می‌کند، پیام را فقط با getMessage ارزان
+    آماده می‌کند و هرگز مسدود نمی‌شود (در صورت پر بودن صف، رکورد دور ریخته و شمارش می‌شود).
+    """
+
+    def __init__(self, log_queue: "queue.Queue[logging.LogRecord]"):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        trace = profiling.current_trace()
+        if trace is not None:
+            record.update_id = getattr(record, "update_id", None) or trace.update_id
+            record.chat_id = getattr(record, "chat_id", None) or trace.chat_id
+            record.stage = getattr(record, "stage", None) or trace.current_stage
+        record.msg = record.getMessage()
+        record.args = None
+        if self.dropped:
+            record.dropped_before = self.dropped
+            self.dropped = 0
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_queue_handler: Optional[ContextQueueHandler] = None
+_repeat_filter: Optional[RepeatFilter] = None
+
+
+def setup_logging(level: int = logging.INFO) -> None:
+    """پیکربندی Root Logger با صف غیرمسدودکننده و نویسنده پس‌زمینه (فراخوانی تکراری بی‌اثر است)."""
+    global _listener, _queue_handler, _repeat_filter
+    if _listener is not None:
+        return
+
+    log_queue: "queue.Queue[logging.LogRecord]" = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    writer = logging.StreamHandler(sys.stdout)
+    writer.setFormatter(JsonLinesFormatter())
+
+    _queue_handler = ContextQueueHandler(log_queue)
+    _queue_handler.addFilter(SamplingFilter())
+    _repeat_filter = RepeatFilter()
+    _queue_handler.addFilter(_repeat_filter)
+
+    root = logging.getLogger()
+    root.handlers = [_queue_handler]
+    root.setLevel(level)
+    # httpx هر درخواست را در سطح INFO با آدرس کامل (شامل توکن ربات تلگرام) لاگ می‌کند
+    for noisy_logger in ("httpx", "httpcore"):
+        logging.getLogger(noisy_logger).setLevel(logging.WARNING)
+
+    _listener = RepeatFlushingListener(log_queue, writer, repeat_filter=_repeat_filter, respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown_logging)
+    # Threadها پس از Fork (مثلاً gunicorn --preload) به پروسه فرزند منتقل نمی‌شوند
+    os.register_at_fork(after_in_child=_restart_after_fork)
+
+
+def _restart_after_fork() -> None:
+    """ساخت صف و Thread نویسنده جدید در پروسه فرزند."""
+    global _listener
+    if _listener is None or _queue_handler is None or _repeat_filter is None:
+        return
+    _repeat_filter.reset_after_fork()
+    log_queue: "queue.Queue[logging.LogRecord]" = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    _queue_handler.queue = log_queue
+    _listener = RepeatFlushingListener(log_queue, *_listener.handlers, repeat_filter=_repeat_filter,
+                                       respect_handler_level=True)
+    _listener.start()
+
+
+def shutdown_logging() -> None:
+    """تخلیه صف و توقف Thread نویسنده."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def get_logger(name: str) -> logging.Logger:
+    """دریافت Logger ماژول (پیکربندی در اولین import این ماژول انجام می‌شود)."""
+    return logging.getLogger(name)
+
+
+setup_logging()
@@ -1,17 +1,29 @@
 # ======================================================================
 # ماژول اصلی محاسبات آسترولوژی
 # این ماژول از Skyfield برای محاسبات نجومی دقیق استفاده می‌کند.
+# موتور سریع (fast_ephemeris) برای پیش‌نمایش‌های رایگان نیز قابل انتخاب است.
 # ======================================================================
 
+import os
 import datetime
 from skyfield.api import load, Topos
 from skyfield.timelib import Time
-from typing import Dict, Any, Tuple
+from typing import Dict, Any, Tuple, Sequence
+
+import numpy as np
+
+import fast_ephemeris
+from app_logging import get_logger
+
+logger = get_logger(__name__)
 
 # ثابت‌ها
 # تکمیل لیست سیارات اصلی برای چارت تولد (از خورشید تا پلوتو)
 PLANETS = ['sun', 'moon', 'mercury', 'venus', 'mars', 'jupiter', 'saturn', 'uranus', 'neptune', 'pluto'] 
 DEGREES_PER_SIGN = 30
+# موتورهای محاسبه: دقیق (Skyfield + JPL) برای چارت‌های پولی، سریع (تحلیلی) برای پیش‌نمایش
+ENGINE_PRECISE = "precise"
+ENGINE_FAST = "fast"
 ZODIAC_SIGNS_FA = ["حمل", "ثور", "جوزا", "سرطان", "اسد", "سنبله", 
                     "میزان", "عقرب", "قوس", "جدی", "دلو", "حوت"]
 PLANET_SYMBOLS_FA = {
@@ -27,16 +39,38 @@ PLANET_SYMBOLS_FA = {
     'pluto': "پلوتو ♇",
 }
 
+# فایل Ephemeris (قابل تغییر با متغیر محیطی EPHEMERIS_FILE)
+EPHEMERIS_FILE = os.environ.get("EPHEMERIS_FILE", "de421.bsp")
+
+def map_ephemeris_segments(ephemeris) -> None:
+    """
+    نگاشت ضرایب همه Segmentهای Kernel به حافظه (jplephem آن‌ها را Read-only و با mmap باز می‌کند).
+    jplephem ضرایب را در اولین محاسبه بارگذاری می‌کند؛ پس برای هر Segment یک موقعیت (در میانه بازه آن)
+    با API عمومی compute محاسبه می‌شود. اگر این کار در پروسه اصلی و پیش از Fork انجام شود
+    (gunicorn --preload)، همه Workerها همان نگاشت‌ها و جداول را به صورت Copy-on-Write به ارث می‌برند
+    و هیچ‌کدام آن‌ها را دوباره نمی‌سازند.
+    """
+    for segment in ephemeris.spk.segments:
+        try:
+            segment.compute((segment.start_jd + segment.end_jd) / 2.0)
+        except ValueError:
+            # Segmentهایی با نوع داده پشتیبانی نشده (در de421 وجود ندارند)
+            pass
+
 # داده‌های نجومی را بارگذاری کنید (یک بار در طول عمر برنامه)
 try:
     # skyfield داده‌های ephemeris را در خود ذخیره می‌کند.
     # توصیه می‌شود از ephemeris‌های کاملتر مانند de430.bsp استفاده شود، اما de421.bsp رایج است.
-    EPHEMERIS = load('de421.bsp')
+    EPHEMERIS = load(EPHEMERIS_FILE)
+    map_ephemeris_segments(EPHEMERIS)
 except Exception as e:
     # برای جلوگیری از کرش در محیط‌هایی که دسترسی به شبکه محدود است
-    print(f"Error loading ephemeris: {e}. Skyfield calculations will fail.")
+    logger.error("Error loading ephemeris: %s. Skyfield calculations will fail.", e)
     EPHEMERIS = None
 
+# جداول مقیاس زمانی (ΔT، ثانیه‌های کبیسه) هم یک بار بارگذاری و بین Workerها به اشتراک گذاشته می‌شوند.
+TIMESCALE = load.timescale()
+
 def get_zodiac_position(lon: float) -> Tuple[str, str]:
     """تبدیل طول جغرافیایی (Ecliptic Longitude) به علامت زودیاک و درجه/دقیقه آن."""
     
@@ -59,7 +93,74 @@ def get_zodiac_position(lon: float) -> Tuple[str, str]:
     
     return sign_name, degree_str
 
-def calculate_natal_chart(birth_time_utc: datetime.datetime, lat: float, lon: float) -> Dict[str, Any]:
+def build_planet_entry(planet_name: str, lon_deg: float) -> Dict[str, Any]:
+    """ساخت ورودی چارت برای یک جرم از روی طول دایرةالبروجی آن."""
+    sign_name, degree_str = get_zodiac_position(lon_deg)
+    return {
+        "name_fa": PLANET_SYMBOLS_FA.get(planet_name, planet_name),
+        "sign_fa": sign_name,
+        "position_str": degree_str,
+        "longitude_deg": round(lon_deg, 4),
+    }
+
+def calculate_fast_chart(birth_time_utc: datetime.datetime, lat: float, lon: float) -> Dict[str, Any]:
+    """
+    محاسبه سریع چارت با سری‌های تحلیلی (بدون فایل Ephemeris).
+    خطای طول کمتر از fast_ephemeris.FAST_ENGINE_MAX_ERROR_DEG درجه است؛ برای برج و درجه کافی است.
+    بیرون از بازه سنجیده شده موتور سریع، به جای نتیجه نادرست بی‌صدا از موتور دقیق استفاده می‌شود.
+    """
+    if not fast_ephemeris.in_validated_range(birth_time_utc):
+        logger.info("Birth time outside the fast engine's validated range, using the precise engine",
+                    extra={"year": birth_time_utc.year})
+        return calculate_natal_chart(birth_time_utc, lat, lon, engine=ENGINE_PRECISE)
+    longitudes = fast_ephemeris.ecliptic_longitudes(fast_ephemeris.julian_day(birth_time_utc), lat, lon)
+    return {
+        planet_name: build_planet_entry(planet_name, float(longitudes[planet_name][0]))
+        for planet_name in PLANETS
+    }
+
+def ephemeris_target(ephemeris, planet_name: str):
+    """
+    مرجع جرم آسمانی در Kernel. de421 مرکز سیارات بیرونی (مریخ تا پلوتو) را ندارد و فقط
+    مرکز جرم منظومه آن‌ها (barycenter) را دارد که برای طول دایرةالبروجی تفاوت محسوسی ندارد.
+    """
+    try:
+        return ephemeris[planet_name]
+    except KeyError:
+        return ephemeris[f"{planet_name} barycenter"]
+
+def topocentric_observer(ephemeris, lat: float, lon: float) -> Topos:
+    """ناظر روی سطح زمین (بیضوی WGS84) در عرض و طول جغرافیایی داده شده."""
+    return ephemeris['earth'] + Topos(latitude_degrees=lat, longitude_degrees=lon)
+
+def precise_ecliptic_longitude(observer, target, t: Time) -> float:
+    """
+    طول دایرةالبروجی توپوسنتریک یک جرم (درجه) با Skyfield: موقعیت Astrometric
+    (با تصحیح زمان سیر نور) نسبت به دایرةالبروج و اعتدال تاریخ (epoch='date').
+    """
+    position = observer.at(t).observe(target)
+    _lat, lon_angle, _distance = position.ecliptic_latlon(epoch='date')
+    return float(lon_angle.degrees)
+
+def validate_fast_engine(times_utc: Sequence[datetime.datetime], lat: float, lon: float) -> Dict[str, float]:
+    """
+    اعتبارسنجی موتور سریع در برابر همان مسیر دقیقی که calculate_natal_chart استفاده می‌کند
+    (همان ناظر، همان اجرام Kernel و همان کاهش Astrometric).
+    خروجی: بیشینه خطای قدر مطلق طول دایرةالبروجی (درجه) برای هر جرم.
+    """
+    if EPHEMERIS is None:
+        raise RuntimeError("Ephemeris is not loaded; cannot validate the fast engine.")
+    observer = topocentric_observer(EPHEMERIS, lat, lon)
+    fast = fast_ephemeris.ecliptic_longitudes([fast_ephemeris.julian_day(t) for t in times_utc], lat, lon)
+    errors: Dict[str, float] = {}
+    for planet_name in PLANETS:
+        target = ephemeris_target(EPHEMERIS, planet_name)
+        precise = np.array([precise_ecliptic_longitude(observer, target, TIMESCALE.utc(t)) for t in times_utc])
+        diff = (fast[planet_name] - precise + 180.0) % 360.0 - 180.0
+        errors[planet_name] = float(np.max(np.abs(diff)))
+    return errors
+
+def calculate_natal_chart(birth_time_utc: datetime.datetime, lat: float, lon: float, engine: str = ENGINE_PRECISE) -> Dict[str, Any]:
     """
     محاسبه موقعیت اجرام آسمانی برای زمان و مکان تولد.
     از محاسبات Topocentric (مشاهده از سطح زمین) برای دقت بالاتر استفاده می‌کند.
@@ -68,49 +169,34 @@ def calculate_natal_chart(birth_time_utc: datetime.datetime, lat: float, lon: fl
         birth_time_utc: زمان تولد به وقت UTC (بهبود یافته از utils).
         lat: عرض جغرافیایی.
         lon: طول جغرافیایی.
+        engine: ENGINE_PRECISE (Skyfield، پیش‌فرض) یا ENGINE_FAST (تحلیلی، برای پیش‌نمایش).
         
     Returns:
         دیکشنری شامل موقعیت اجرام آسمانی.
     """
     
+    if engine == ENGINE_FAST:
+        return calculate_fast_chart(birth_time_utc, lat, lon)
+
     if EPHEMERIS is None:
         return {"error": "منابع نجومی (Ephemeris) بارگذاری نشده‌اند. لطفاً اتصال شبکه را بررسی کنید."}
         
     # ۱. تعریف زمان (Time)
-    ts = load.timescale()
     # Skyfield زمان را بر اساس زمان پایتون (datetime.datetime) تفسیر می‌کند.
-    t: Time = ts.utc(birth_time_utc) 
+    t: Time = TIMESCALE.utc(birth_time_utc) 
     
     # ۲. تعریف موقعیت مشاهده گر (Topocentric Observer)
-    observer: Topos = EPHEMERIS['earth'] + Topos(latitude_degrees=lat, longitude_degrees=lon)
+    observer: Topos = topocentric_observer(EPHEMERIS, lat, lon)
     
     chart_data: Dict[str, Any] = {}
     
     # ۳. محاسبه موقعیت اجرام (Topocentric Ecliptic Longitude)
     for planet_name in PLANETS:
         try:
-            # مرجع جرم آسمانی
-            planet_ephem = EPHEMERIS[planet_name]
-            
-            # مشاهده موقعیت جرم از دید ناظر
-            position = observer.at(t).observe(planet_ephem)
-            
-            # محاسبه طول، عرض و فاصله در دستگاه مختصات دایرةالبروج (Ecliptic Longitude)
-            # epoch='date' برای استفاده از Equinox تاریخ مشاهده به جای J2000
-            lon_rad, lat_rad, distance = position.ecliptic_lonlat(epoch='date')
-            
-            # تبدیل به درجه
-            lon_deg = lon_rad.degrees
+            lon_deg = precise_ecliptic_longitude(observer, ephemeris_target(EPHEMERIS, planet_name), t)
             
             # محاسبه علامت زودیاک و درجه/دقیقه
-            sign_name, degree_str = get_zodiac_position(lon_deg)
-            
-            chart_data[planet_name] = {
-                "name_fa": PLANET_SYMBOLS_FA.get(planet_name, planet_name),
-                "sign_fa": sign_name,
-                "position_str": degree_str,
-                "longitude_deg": round(lon_deg, 4),
-            }
+            chart_data[planet_name] = build_planet_entry(planet_name, lon_deg)
         
         except Exception as e:
             chart_data[planet_name] = {"error": f"Error calculating {planet_name}: {e}"}
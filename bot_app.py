@@ -3,9 +3,11 @@
 # این برنامه درخواست‌های وب‌هوک تلگرام را دریافت و پردازش می‌کند.
 # ======================================================================
 
-from fastapi import FastAPI, Request, HTTPException, Body
+from fastapi import FastAPI, Request, HTTPException, Body, Header
+from fastapi.responses import PlainTextResponse
 from typing import Dict, Any, Optional
 import os
+import hmac
 import datetime # 👈 اصلاح: ایمپورت اضافه شد
 import pytz     # 👈 اصلاح: ایمپورت اضافه شد
 
@@ -13,8 +15,14 @@ import pytz     # 👈 اصلاح: ایمپورت اضافه شد
 import utils
 import keyboards
 import astrology_core
+import profiling
+import memory_report
+import shared_state
+from app_logging import get_logger
 from persiantools.jdatetime import JalaliDateTime
 
+logger = get_logger(__name__)
+
 # --- تنظیمات ضروری ---
 
 # ⚠️ مهم: این متغیر باید در محیط دیپلوی (Environment Variables) تنظیم شود. 
@@ -23,17 +31,21 @@ BOT_TOKEN = os.environ.get("BOT_TOKEN")
 
 # بررسی توکن در زمان اجرا
 if not BOT_TOKEN or BOT_TOKEN == "YOUR_TELEGRAM_BOT_TOKEN":
-    print("FATAL ERROR: BOT_TOKEN environment variable is not set correctly.")
+    logger.critical("FATAL ERROR: BOT_TOKEN environment variable is not set correctly.")
     # می‌توانیم برنامه را در اینجا با خطا متوقف کنیم یا یک مقدار پیش‌فرض را برای تست محلی تنظیم کنیم.
     # در محیط کانتینر، بهتر است روی خطای 404 تکیه کنیم.
 
+# توکن دسترسی به endpointهای مدیریتی (/admin/...). اگر تنظیم نشود، این endpointها غیرفعال هستند.
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN")
+
 # ❌ حذف متغیر WEBHOOK_URL که به اشتباه برای نگهداری Secret Token استفاده می‌شد.
 # WEBHOOK_URL = os.environ.get("WEBHOOK_URL", "YOUR_SECRET_TOKEN") 
 
 
 # --- وضعیت کاربر (User State) ---
 
-USER_STATE: Dict[int, Dict[str, Any]] = {}
+# وضعیت گفتگو در shared_state (SQLite مشترک بین Workerها) ذخیره می‌شود، چون آپدیت‌های
+# یک چت ممکن است به Workerهای مختلف برسند. فقط مقادیر متنی ذخیره و اشیاء از روی آن‌ها بازسازی می‌شوند.
 STEP_INPUT_DATE = "INPUT_DATE"
 STEP_INPUT_TIME = "INPUT_TIME"
 STEP_INPUT_CITY = "INPUT_CITY"
@@ -42,31 +54,41 @@ STEP_READY_TO_CALCULATE = "READY"
 
 # --- توابع کمکی ---
 
-def get_user_state(user_id: int) -> Dict[str, Any]:
-    """دریافت وضعیت جاری کاربر یا مقداردهی اولیه آن."""
-    if user_id not in USER_STATE:
-        USER_STATE[user_id] = {
-            "step": "START",
-            "date_fa": None,
-            "time_str": None,
-            "city_name": None,
-            "jdate_obj": None,
-            "time_obj": None
-        }
-    return USER_STATE[user_id]
+# کلیدهایی از وضعیت که در ذخیره‌ساز مشترک نوشته می‌شوند (jdate_obj و time_obj از date_fa و time_str ساخته می‌شوند)
+_PERSISTED_STATE_KEYS = ("step", "date_fa", "time_str", "city_name")
 
-def reset_user_state(user_id: int) -> None:
-    """بازنشانی وضعیت کاربر."""
-    USER_STATE[user_id] = {
-        "step": "START", 
-        "date_fa": None, 
-        "time_str": None, 
-        "city_name": None, 
+def new_user_state() -> Dict[str, Any]:
+    """وضعیت اولیه یک کاربر."""
+    return {
+        "step": "START",
+        "date_fa": None,
+        "time_str": None,
+        "city_name": None,
         "jdate_obj": None,
         "time_obj": None
     }
 
-def build_chart_summary(chart_data: Dict[str, Any]) -> str:
+def get_user_state(user_id: int) -> Dict[str, Any]:
+    """دریافت وضعیت جاری کاربر از ذخیره‌ساز مشترک (یا وضعیت اولیه)."""
+    state = new_user_state()
+    stored = shared_state.load_user_state(user_id)
+    if stored:
+        state.update(stored)
+        if state['date_fa']:
+            state['jdate_obj'] = utils.parse_persian_date(state['date_fa'])
+        if state['time_str']:
+            state['time_obj'] = datetime.datetime.strptime(state['time_str'], "%H:%M").time()
+    return state
+
+def save_user_state(user_id: int, state: Dict[str, Any]) -> None:
+    """ذخیره تغییرات وضعیت کاربر در ذخیره‌ساز مشترک."""
+    shared_state.save_user_state(user_id, {key: state[key] for key in _PERSISTED_STATE_KEYS})
+
+def reset_user_state(user_id: int) -> None:
+    """بازنشانی وضعیت کاربر."""
+    save_user_state(user_id, new_user_state())
+
+def build_chart_summary(chart_data: Dict[str, Any], state: Dict[str, Any]) -> str:
     """ایجاد یک خلاصه زیبا از چارت برای کاربر."""
     if "error" in chart_data:
         return f"❌ خطای محاسباتی: {chart_data['error']}\nلطفاً دوباره امتحان کنید."
@@ -74,7 +96,6 @@ def build_chart_summary(chart_data: Dict[str, Any]) -> str:
     summary = "✨ **خلاصه چارت نجومی شما** ✨\n\n"
     
     # اطلاعات ورودی
-    state = USER_STATE.get(chart_data.get('user_id', 0), {})
     summary += f"_زمان تولد:_ {state.get('date_fa', 'نامشخص')} {state.get('time_str', 'نامشخص')}\n"
     summary += f"_محل تولد:_ {state.get('city_name', 'نامشخص')}\n\n"
 
@@ -96,17 +117,37 @@ def build_chart_summary(chart_data: Dict[str, Any]) -> str:
 
 # --- توابع هندلر ---
 
-async def handle_start_command(chat_id: int) -> None:
+async def show_menu(chat_id: int, text: str, reply_markup: Optional[Dict[str, Any]], message_id: Optional[int] = None) -> None:
+    """
+    نمایش یک منو: اگر message_id یک پیام منوی ثبت شده ربات باشد، همان پیام درجا ویرایش می‌شود.
+    کلیک روی دکمه‌های پیام‌های دیگر (مثلاً خلاصه چارت) یک پیام منوی جدید می‌سازد تا محتوای آن پاک نشود.
+    پیام جدید همچنین وقتی ارسال می‌شود که تلگرام اعلام کند پیام قابل ویرایش نیست یا پیدا نشد؛
+    در خطاهای گذرا (429، 5xx، Timeout) چیزی ارسال نمی‌شود تا فشار روی API دو برابر نشود
+    و منوی تکراری ساخته نشود (کاربر می‌تواند دوباره روی دکمه بزند).
+    """
+    if message_id is not None and utils.is_menu_message(chat_id, message_id):
+        result = await utils.edit_message(BOT_TOKEN, chat_id, message_id, text, reply_markup)
+        if result != utils.EDIT_NOT_EDITABLE:
+            return
+    sent_message_id = await utils.send_message(BOT_TOKEN, chat_id, text, reply_markup)
+    if sent_message_id is not None:
+        utils.remember_menu_message(chat_id, sent_message_id, text, reply_markup)
+
+async def handle_start_command(chat_id: int, message_id: Optional[int] = None) -> None:
     """هندلر دستور /start یا MAIN|WELCOME."""
-    reset_user_state(chat_id)
+    with profiling.stage("state"):
+        reset_user_state(chat_id)
     welcome_text = (
         "سلام! به ربات تخصصی آسترولوژی، سنگ‌شناسی و نمادشناسی خوش آمدید. "
         "لطفاً از منوی زیر، سرویس مورد نظر خود را انتخاب کنید\\."
     )
-    await utils.send_message(BOT_TOKEN, chat_id, welcome_text, keyboards.main_menu_keyboard())
+    await show_menu(chat_id, welcome_text, keyboards.main_menu_keyboard(), message_id)
 
-async def handle_callback_query(chat_id: int, callback_id: str, data: str) -> None:
-    """هندلر کلیک‌های کیبورد اینلاین."""
+async def handle_callback_query(chat_id: int, callback_id: str, data: str, message_id: Optional[int] = None) -> None:
+    """
+    هندلر کلیک‌های کیبورد اینلاین.
+    message_id پیامی است که دکمه روی آن کلیک شده و منوی مقصد درجا روی همان پیام رندر می‌شود.
+    """
     # 1. پاسخ به Callback Query برای حذف ساعت چرخان
     await utils.answer_callback_query(BOT_TOKEN, callback_id)
 
@@ -115,19 +156,20 @@ async def handle_callback_query(chat_id: int, callback_id: str, data: str) -> No
     
     # اگر داده از ساختار مورد انتظار پیروی نمی‌کند، از آن چشم‌پوشی می‌کنیم یا به منوی اصلی باز می‌گردیم.
     if len(parts) < 3:
-        await handle_start_command(chat_id)
+        await handle_start_command(chat_id, message_id)
         return
 
     menu, submenu, action = parts[0], parts[1], parts[2]
     
     response_text = "لطفاً یک گزینه را انتخاب کنید:"
     reply_markup = None
-    state = get_user_state(chat_id)
+    with profiling.stage("state"):
+        state = get_user_state(chat_id)
 
     # مسیریابی منوی اصلی
     if menu == 'MAIN':
         if submenu == 'WELCOME':
-            await handle_start_command(chat_id)
+            await handle_start_command(chat_id, message_id)
             return
         elif submenu == 'SERVICES':
             response_text = "بخش خدمات: چه نوع تحلیل یا ابزاری نیاز دارید؟"
@@ -151,7 +193,9 @@ async def handle_callback_query(chat_id: int, callback_id: str, data: str) -> No
             elif action == 'CHART_INPUT':
                 response_text = "لطفاً تاریخ تولد خود را به فرمت شمسی (مثلاً *1370/01/01*) ارسال کنید\\."
                 reply_markup = keyboards.back_to_main_menu_keyboard()
-                state['step'] = STEP_INPUT_DATE
+                with profiling.stage("state"):
+                    state['step'] = STEP_INPUT_DATE
+                    save_user_state(chat_id, state)
             
         elif submenu == 'GEM':
             response_text = "خدمات سنگ‌شناسی:"
@@ -159,15 +203,14 @@ async def handle_callback_query(chat_id: int, callback_id: str, data: str) -> No
             
         # ... سایر زیرمنوها (SIGIL, HERB) ...
 
-    # ارسال پاسخ نهایی
-    # ⚠️ نیاز به utils.edit_message برای ویرایش پیام قبلی
-    # فرض می‌کنیم utils.send_message در اینجا کافی است
-    await utils.send_message(BOT_TOKEN, chat_id, response_text, reply_markup)
+    # نمایش پاسخ نهایی با ویرایش درجای پیام قبلی (بدون فراخوانی API اگر تغییری نکرده باشد)
+    await show_menu(chat_id, response_text, reply_markup, message_id)
 
 async def handle_text_message(chat_id: int, text: str) -> None:
     """هندلر پیام‌های متنی از کاربر."""
-    state = get_user_state(chat_id)
-    current_step = state['step']
+    with profiling.stage("state"):
+        state = get_user_state(chat_id)
+        current_step = state['step']
     response_text = "ورودی نامعتبر. لطفاً مطابق درخواست قبلی، اطلاعات را وارد کنید."
     reply_markup = keyboards.back_to_main_menu_keyboard()
 
@@ -199,9 +242,17 @@ async def handle_text_message(chat_id: int, text: str) -> None:
         # 1. دریافت مختصات و منطقه زمانی (عملیات Blocking I/O که در utils آسنکرون شده است)
         await utils.send_message(BOT_TOKEN, chat_id, "⏳ در حال جستجوی شهر و منطقه زمانی شما\\...", None)
         # ⚠️ نیاز به چک کردن تابع get_coordinates_from_city در utils برای آسنکرون بودن
-        lat, lon, tz = await utils.get_coordinates_from_city(city_name)
+        geocoding_available = True
+        try:
+            lat, lon, tz = await utils.get_coordinates_from_city(city_name)
+        except utils.GeocodingUnavailableError:
+            geocoding_available = False
         
-        if lat is None or lon is None:
+        if not geocoding_available:
+            # خرابی موقت سرویس مکان‌یابی را به عنوان «شهر پیدا نشد» گزارش نمی‌کنیم
+            response_text = "سرویس جستجوی شهر در حال حاضر در دسترس نیست\\. لطفاً چند لحظه دیگر دوباره نام شهر را ارسال کنید\\."
+            state['step'] = STEP_INPUT_CITY # می‌مانیم تا دوباره تلاش کند
+        elif lat is None or lon is None:
             response_text = f"متأسفانه شهر *{city_name}* پیدا نشد\\. لطفاً نام شهر را با دقت بیشتری وارد کنید\\."
             state['step'] = STEP_INPUT_CITY # می‌مانیم تا دوباره تلاش کند
         else:
@@ -219,14 +270,17 @@ async def handle_text_message(chat_id: int, text: str) -> None:
             dt_local_with_tz = tz.localize(dt_local)
             birth_time_utc = dt_local_with_tz.astimezone(pytz.utc)
             
-            # 3. محاسبه چارت (عملیات CPU-Bound)
-            chart_data = astrology_core.calculate_natal_chart(birth_time_utc, lat, lon)
-            chart_data['user_id'] = chat_id # برای نمایش خلاصه
+            # 3. محاسبه چارت: خلاصه رایگان فقط به برج و درجه نیاز دارد، پس موتور سریع کافی است
+            with profiling.stage("ephemeris"):
+                chart_data = astrology_core.calculate_natal_chart(birth_time_utc, lat, lon, engine=astrology_core.ENGINE_FAST)
 
             # 4. نمایش نتیجه و بازنشانی وضعیت
-            response_text = build_chart_summary(chart_data)
+            response_text = build_chart_summary(chart_data, state)
             reply_markup = keyboards.main_menu_keyboard()
-            reset_user_state(chat_id) # عملیات کامل شد
+            state = new_user_state() # عملیات کامل شد
+
+    with profiling.stage("state"):
+        save_user_state(chat_id, state)
 
     # ارسال پاسخ نهایی
     await utils.send_message(BOT_TOKEN, chat_id, response_text, reply_markup)
@@ -245,19 +299,35 @@ async def webhook_handler(request: Request):
     # if request.headers.get("x-telegram-bot-api-secret-token") != WEBHOOK_URL:
     #     raise HTTPException(status_code=403, detail="Invalid Secret Token")
     
-    body = await request.json()
+    with profiling.trace_request() as trace:
+        with profiling.stage("parse"):
+            body = await request.json()
+        trace.update_id = body.get('update_id')
+        await process_update(body)
+        
+    return {"ok": True}
+
+async def process_update(body: Dict[str, Any]) -> None:
+    """مسیریابی یک آپدیت تلگرام به هندلر مناسب."""
+    trace = profiling.current_trace()
     
     # بررسی کنید که آیا به‌روزرسانی شامل پیام یا Callback Query است
     if 'message' in body:
         message = body['message']
         chat_id = message['chat']['id']
         text = message.get('text', '')
+        if trace is not None:
+            trace.chat_id = chat_id
+        
+        # مرحله جاری فقط برای مسیریابی خوانده می‌شود؛ زمان state داخل هندلرها ثبت می‌شود
+        with profiling.stage("state"):
+            current_step = get_user_state(chat_id)['step']
         
         # هندل دستور /start
         if text.startswith('/start'):
             await handle_start_command(chat_id)
         # هندل پیام متنی عادی
-        elif text and get_user_state(chat_id)['step'] != 'START':
+        elif text and current_step != 'START':
             await handle_text_message(chat_id, text)
         # اگر کاربر در حالت START چیزی نوشت (به جز /start)
         else:
@@ -266,12 +336,54 @@ async def webhook_handler(request: Request):
     elif 'callback_query' in body:
         query = body['callback_query']
         chat_id = query['message']['chat']['id']
+        message_id = query['message'].get('message_id')
         callback_id = query['id']
         data = query['data']
+        if trace is not None:
+            trace.chat_id = chat_id
         
-        await handle_callback_query(chat_id, callback_id, data)
-        
-    return {"ok": True}
+        await handle_callback_query(chat_id, callback_id, data, message_id)
+
+
+# --- endpointهای مدیریتی (پروفایلینگ) ---
+
+def check_admin_token(token: Optional[str]) -> None:
+    """بررسی توکن مدیریتی؛ اگر ADMIN_TOKEN تنظیم نشده باشد endpoint وجود خارجی ندارد (404)."""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    # مقایسه بایت‌ها: compare_digest روی str با کاراکتر غیر ASCII خطای TypeError (و پاسخ 500) می‌دهد
+    if not token or not hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+@app.get("/admin/profile", response_class=PlainTextResponse)
+async def admin_profile(seconds: float = 10, x_admin_token: Optional[str] = Header(None)):
+    """
+    اجرای پروفایلر نمونه‌بردار برای `seconds` ثانیه (حداکثر profiling.PROFILER_MAX_SECONDS)
+    روی همه Threadهای پروسه و بازگرداندن Collapsed Stacks (ورودی flamegraph).
+    """
+    check_admin_token(x_admin_token)
+    collapsed = await profiling.profile_for(seconds)
+    if collapsed is None:
+        raise HTTPException(status_code=409, detail="A profile is already running")
+    return collapsed
+
+@app.get("/admin/slow-requests")
+async def admin_slow_requests(x_admin_token: Optional[str] = Header(None)):
+    """آخرین آپدیت‌های کندتر از آستانه به همراه زمان‌بندی هر مرحله."""
+    check_admin_token(x_admin_token)
+    return {
+        "threshold_ms": profiling.SLOW_REQUEST_THRESHOLD_MS,
+        "requests": list(profiling.SLOW_REQUESTS),
+    }
+
+@app.get("/admin/memory")
+async def admin_memory(x_admin_token: Optional[str] = Header(None)):
+    """
+    گزارش حافظه همه Workerها (rss، pss و private) و سهم نگاشت فایل Ephemeris در هر کدام.
+    در حالت چند-Worker، pss هر Worker تقریباً برابر (حافظه مشترک / تعداد Workerها) + private است.
+    """
+    check_admin_token(x_admin_token)
+    return memory_report.deployment_report(astrology_core.EPHEMERIS_FILE)
 
 @app.get("/")
 async def health_check():
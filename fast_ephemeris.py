@@ -0,0 +1,254 @@
+# ======================================================================
+# موتور سریع (کم‌دقت) محاسبه موقعیت سیارات
+# این ماژول موقعیت اجرام را با سری‌های تحلیلی کوتاه‌شده (عناصر مداری
+# به همراه جملات اختلال اصلی، به روش Meeus / Schlyter) به صورت برداری در NumPy
+# محاسبه می‌کند و به هیچ فایل Ephemeris نیاز ندارد.
+#
+# کاربرد: پیش‌نمایش رایگان (فقط برج و درجه). برای چارت‌های پولی از موتور دقیق
+# Skyfield در astrology_core استفاده کنید.
+#
+# سنجش خطا (طول دایرةالبروجی توپوسنتریک، با همان کاهشی که موتور دقیق astrology_core انجام
+# می‌دهد: موقعیت Astrometric با تصحیح زمان سیر نور، ناظر WGS84، دایرةالبروج و اعتدال تاریخ):
+# - قابل تکرار در همین مخزن (test_fast_ephemeris.py): Kernelهای آزمایشی همراه Skyfield،
+#   de430-2015-03-02.bsp (2015-02-28 تا 2015-03-05) و de441-1969.bsp (1969-07-26 تا 1969-07-29)،
+#   نمونه‌های سه ساعته در سه مکان؛ بیشترین خطا 0.035° (ماه)، سایر اجرام کمتر از 0.021°.
+# - یک بار هنگام توسعه با اسکریپتی خارج از مخزن (غیرقابل تکرار از اینجا): بسته de421 در PyPI
+#   با پیاده‌سازی مستقل همان کاهش، ۲۰۰۰ زمان و مکان تصادفی بین ۱۹۲۰ تا ۲۰۴۰؛ بیشترین خطا
+#   0.090° برای ماه و 0.047° برای بقیه اجرام.
+# بیرون از بازه FAST_ENGINE_MIN_YEAR تا FAST_ENGINE_MAX_YEAR خطا سنجیده نشده است (سری پلوتو
+# حداکثر تا 1885 تا 2099 معتبر است)؛ astrology_core در این حالت به موتور دقیق برمی‌گردد.
+# کران کلی مستند شده: FAST_ENGINE_MAX_ERROR_DEG
+# ======================================================================
+
+import datetime
+import numpy as np
+from typing import Dict, Sequence
+
+# کران خطای مستند شده برای طول دایرةالبروجی (درجه)
+FAST_ENGINE_MAX_ERROR_DEG = 0.1
+# بازه سال‌هایی که خطای موتور در آن سنجیده شده است (شامل هر دو سر)
+FAST_ENGINE_MIN_YEAR = 1920
+FAST_ENGINE_MAX_YEAR = 2040
+
+# ترتیب اجرام (هم‌راستا با astrology_core.PLANETS)
+BODIES = ['sun', 'moon', 'mercury', 'venus', 'mars', 'jupiter', 'saturn', 'uranus', 'neptune', 'pluto']
+
+# شعاع استوایی زمین بر حسب واحد نجومی (برای تبدیل فاصله‌ها)
+EARTH_RADIUS_AU = 6378.137 / 149597870.7
+
+# عناصر مداری نسبت به دایرةالبروج و اعتدال تاریخ، به صورت (مقدار پایه، نرخ روزانه)
+# ترتیب ستون‌ها: N (گره صعودی)، i (میل)، w (حضیض)، a (نیم‌قطر بزرگ)، e (خروج از مرکز)، M (آنومالی میانگین)
+# مبدأ زمان: d = 0 در 2000 Jan 0.0 (JD 2451543.5)
+# واحد a برای ماه شعاع زمین و برای بقیه واحد نجومی است.
+_ELEMENTS = {
+    'sun':     ((0.0, 0.0), (0.0, 0.0), (282.9404, 4.70935e-5), (1.0, 0.0),
+                (0.016709, -1.151e-9), (356.0470, 0.9856002585)),
+    'moon':    ((125.1228, -0.0529538083), (5.1454, 0.0), (318.0634, 0.1643573223), (60.2666, 0.0),
+                (0.054900, 0.0), (115.3654, 13.0649929509)),
+    'mercury': ((48.3313, 3.24587e-5), (7.0047, 5.00e-8), (29.1241, 1.01444e-5), (0.387098, 0.0),
+                (0.205635, 5.59e-10), (168.6562, 4.0923344368)),
+    'venus':   ((76.6799, 2.46590e-5), (3.3946, 2.75e-8), (54.8910, 1.38374e-5), (0.723330, 0.0),
+                (0.006773, -1.302e-9), (48.0052, 1.6021302244)),
+    'mars':    ((49.5574, 2.11081e-5), (1.8497, -1.78e-8), (286.5016, 2.92961e-5), (1.523688, 0.0),
+                (0.093405, 2.516e-9), (18.6021, 0.5240207766)),
+    'jupiter': ((100.4542, 2.76854e-5), (1.3030, -1.557e-7), (273.8777, 1.64505e-5), (5.20256, 0.0),
+                (0.048498, 4.469e-9), (19.8950, 0.0830853001)),
+    'saturn':  ((113.6634, 2.38980e-5), (2.4886, -1.081e-7), (339.3939, 2.97661e-5), (9.55475, 0.0),
+                (0.055546, -9.499e-9), (316.9670, 0.0334442282)),
+    'uranus':  ((74.0005, 1.3978e-5), (0.7733, 1.9e-8), (96.6612, 3.0565e-5), (19.18171, -1.55e-8),
+                (0.047318, 7.45e-9), (142.5905, 0.011725806)),
+    'neptune': ((131.7806, 3.0173e-5), (1.7700, -2.55e-7), (272.8461, -6.027e-6), (30.05826, 3.313e-8),
+                (0.008606, 2.15e-9), (260.2471, 0.005995147)),
+}
+_ORBIT_BODIES = list(_ELEMENTS)
+# آرایه (جرم، عنصر، [پایه، نرخ]) برای محاسبه برداری همه اجرام در یک مرحله
+_ELEMENT_TABLE = np.array([_ELEMENTS[b] for b in _ORBIT_BODIES], dtype=float)
+
+# جملات اختلال طول ماه: (ضریب درجه، ضرایب [Mm, Ms, D, F])
+_MOON_LON_TERMS = np.array([
+    (-1.274, 1, 0, -2, 0),   # Evection
+    (0.658, 0, 0, 2, 0),     # Variation
+    (-0.186, 0, 1, 0, 0),    # Yearly equation
+    (-0.059, 2, 0, -2, 0),
+    (-0.057, 1, 1, -2, 0),
+    (0.053, 1, 0, 2, 0),
+    (0.046, 0, -1, 2, 0),
+    (0.041, 1, -1, 0, 0),
+    (-0.035, 0, 0, 1, 0),    # Parallactic equation
+    (-0.031, 1, 1, 0, 0),
+    (-0.015, 0, 0, -2, 2),
+    (0.011, 1, 0, -4, 0),
+])
+_MOON_LAT_TERMS = np.array([
+    (-0.173, 0, 0, -2, 1),
+    (-0.055, 1, 0, -2, -1),
+    (-0.046, 1, 0, -2, 1),
+    (0.033, 0, 0, 2, 1),
+    (0.017, 2, 0, 0, 1),
+])
+
+
+def julian_day(dt: datetime.datetime) -> float:
+    """تبدیل datetime (UTC یا بدون منطقه زمانی که UTC فرض می‌شود) به روز ژولینی."""
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return 2451545.0 + (dt - datetime.datetime(2000, 1, 1, 12)).total_seconds() / 86400.0
+
+
+def in_validated_range(dt: datetime.datetime) -> bool:
+    """آیا زمان داده شده در بازه سال‌هایی است که خطای موتور سریع برای آن سنجیده شده است."""
+    return FAST_ENGINE_MIN_YEAR <= dt.year <= FAST_ENGINE_MAX_YEAR
+
+
+def _solve_kepler(M: np.ndarray, e: np.ndarray) -> np.ndarray:
+    """حل معادله کپلر (رادیان) با چند تکرار نیوتن به صورت برداری."""
+    E = M + e * np.sin(M) * (1.0 + e * np.cos(M))
+    for _ in range(4):
+        E = E - (E - e * np.sin(E) - M) / (1.0 - e * np.cos(E))
+    return E
+
+
+def _orbit_positions(d: np.ndarray) -> np.ndarray:
+    """
+    موقعیت مستطیلی دایرةالبروجی (اعتدال تاریخ) اجرام دارای عناصر مداری.
+    برای خورشید و ماه موقعیت زمین‌مرکز و برای سیارات خورشیدمرکز است.
+    خروجی با شکل (تعداد اجرام، ۳، تعداد زمان‌ها).
+    """
+    el = _ELEMENT_TABLE[:, :, 0, None] + _ELEMENT_TABLE[:, :, 1, None] * d[None, None, :]
+    N, i, w = np.radians(el[:, 0]), np.radians(el[:, 1]), np.radians(el[:, 2])
+    a, e, M = el[:, 3], el[:, 4], np.radians(el[:, 5] % 360.0)
+
+    E = _solve_kepler(M, e)
+    xv = a * (np.cos(E) - e)
+    yv = a * np.sqrt(1.0 - e * e) * np.sin(E)
+    v = np.arctan2(yv, xv)
+    r = np.hypot(xv, yv)
+
+    vw = v + w
+    cos_n, sin_n, cos_i = np.cos(N), np.sin(N), np.cos(i)
+    x = r * (cos_n * np.cos(vw) - sin_n * np.sin(vw) * cos_i)
+    y = r * (sin_n * np.cos(vw) + cos_n * np.sin(vw) * cos_i)
+    z = r * np.sin(vw) * np.sin(i)
+    return np.stack([x, y, z], axis=1)
+
+
+def _spherical(xyz: np.ndarray):
+    """تبدیل مختصات مستطیلی به (طول، عرض، فاصله) بر حسب رادیان."""
+    x, y, z = xyz[..., 0, :], xyz[..., 1, :], xyz[..., 2, :]
+    return np.arctan2(y, x), np.arctan2(z, np.hypot(x, y)), np.sqrt(x * x + y * y + z * z)
+
+
+def _rectangular(lon: np.ndarray, lat: np.ndarray, r: np.ndarray) -> np.ndarray:
+    """تبدیل (طول، عرض، فاصله) به مختصات مستطیلی."""
+    return np.stack([r * np.cos(lat) * np.cos(lon), r * np.cos(lat) * np.sin(lon), r * np.sin(lat)], axis=-2)
+
+
+def _perturbation(terms: np.ndarray, args: np.ndarray, func=np.sin) -> np.ndarray:
+    """جمع جملات اختلال تناوبی (درجه) برای آرگومان‌های بنیادی args (رادیان، شکل (k, n))."""
+    return terms[:, 0] @ func(terms[:, 1:] @ args)
+
+
+def _pluto_heliocentric(d: np.ndarray) -> np.ndarray:
+    """موقعیت خورشیدمرکز پلوتو با سری Schlyter (معتبر حدوداً 1885 تا 2099)."""
+    S = np.radians(50.03 + 0.033459652 * d)
+    P = np.radians(238.95 + 0.003968789 * d)
+    lon = (238.9508 + 0.00400703 * d
+           - 19.799 * np.sin(P) + 19.848 * np.cos(P)
+           + 0.897 * np.sin(2 * P) - 4.956 * np.cos(2 * P)
+           + 0.610 * np.sin(3 * P) + 1.211 * np.cos(3 * P)
+           - 0.341 * np.sin(4 * P) - 0.190 * np.cos(4 * P)
+           + 0.128 * np.sin(5 * P) - 0.034 * np.cos(5 * P)
+           - 0.038 * np.sin(6 * P) + 0.031 * np.cos(6 * P)
+           + 0.020 * np.sin(S - P) - 0.010 * np.cos(S - P))
+    lat = (-3.9082
+           - 5.453 * np.sin(P) - 14.975 * np.cos(P)
+           + 3.527 * np.sin(2 * P) + 1.673 * np.cos(2 * P)
+           - 1.051 * np.sin(3 * P) + 0.328 * np.cos(3 * P)
+           + 0.179 * np.sin(4 * P) - 0.292 * np.cos(4 * P)
+           + 0.019 * np.sin(5 * P) + 0.100 * np.cos(5 * P)
+           - 0.031 * np.sin(6 * P) - 0.026 * np.cos(6 * P)
+           + 0.011 * np.cos(S - P))
+    r = (40.72
+         + 6.68 * np.sin(P) + 6.90 * np.cos(P)
+         - 1.18 * np.sin(2 * P) - 0.03 * np.cos(2 * P)
+         + 0.15 * np.sin(3 * P) - 0.14 * np.cos(3 * P))
+    # نرخ خطی طول (0.00400703 درجه در روز) تقدیم اعتدالین را هم شامل می‌شود؛ خروجی برای اعتدال تاریخ است.
+    return _rectangular(np.radians(lon), np.radians(lat), r)
+
+
+def ecliptic_longitudes(jd_ut: Sequence[float], lat: float, lon: float) -> Dict[str, np.ndarray]:
+    """
+    طول دایرةالبروجی توپوسنتریک (اعتدال تاریخ، درجه در بازه 0 تا 360) برای همه BODIES.
+    jd_ut می‌تواند یک عدد یا آرایه‌ای از روزهای ژولینی (UT) باشد؛ محاسبه کاملاً برداری است.
+    """
+    jd = np.atleast_1d(np.asarray(jd_ut, dtype=float))
+    d = jd - 2451543.5
+    pos = _orbit_positions(d)
+    idx = {name: k for k, name in enumerate(_ORBIT_BODIES)}
+
+    # آنومالی‌های میانگین و طول‌های میانگین برای جملات اختلال
+    el = _ELEMENT_TABLE[:, :, 0, None] + _ELEMENT_TABLE[:, :, 1, None] * d[None, None, :]
+    M = np.radians(el[:, 5])
+    mean_lon = np.radians(el[:, 0] + el[:, 2] + el[:, 5])
+    Ms, Mm = M[idx['sun']], M[idx['moon']]
+    Mj, Msat, Mu = M[idx['jupiter']], M[idx['saturn']], M[idx['uranus']]
+
+    geo: Dict[str, np.ndarray] = {}
+    sun = pos[idx['sun']]
+    geo['sun'] = sun
+
+    # ماه: جملات اختلال اصلی (Evection، Variation، ...)
+    moon_lon, moon_lat, moon_r = _spherical(pos[idx['moon']])
+    D = mean_lon[idx['moon']] - mean_lon[idx['sun']]
+    F = mean_lon[idx['moon']] - np.radians(el[idx['moon'], 0])
+    args = np.stack([Mm, Ms, D, F])
+    moon_lon = moon_lon + np.radians(_perturbation(_MOON_LON_TERMS, args))
+    moon_lat = moon_lat + np.radians(_perturbation(_MOON_LAT_TERMS, args))
+    moon_r = moon_r - 0.58 * np.cos(Mm - 2 * D) - 0.46 * np.cos(2 * D)
+    geo['moon'] = _rectangular(moon_lon, moon_lat, moon_r * EARTH_RADIUS_AU)
+
+    # اختلالات متقابل مشتری، زحل و اورانوس
+    deg = np.radians
+    helio_lon, helio_lat, helio_r = _spherical(pos)
+    helio_lon[idx['jupiter']] += deg(
+        -0.332 * np.sin(2 * Mj - 5 * Msat - deg(67.6)) - 0.056 * np.sin(2 * Mj - 2 * Msat + deg(21))
+        + 0.042 * np.sin(3 * Mj - 5 * Msat + deg(21)) - 0.036 * np.sin(Mj - 2 * Msat)
+        + 0.022 * np.cos(Mj - Msat) + 0.023 * np.sin(2 * Mj - 3 * Msat + deg(52))
+        - 0.016 * np.sin(Mj - 5 * Msat - deg(69)))
+    helio_lon[idx['saturn']] += deg(
+        0.812 * np.sin(2 * Mj - 5 * Msat - deg(67.6)) - 0.229 * np.cos(2 * Mj - 4 * Msat - deg(2))
+        + 0.119 * np.sin(Mj - 2 * Msat - deg(3)) + 0.046 * np.sin(2 * Mj - 6 * Msat - deg(69))
+        + 0.014 * np.sin(Mj - 3 * Msat + deg(32)))
+    helio_lat[idx['saturn']] += deg(
+        -0.020 * np.cos(2 * Mj - 4 * Msat - deg(2)) + 0.018 * np.sin(2 * Mj - 6 * Msat - deg(49)))
+    helio_lon[idx['uranus']] += deg(
+        0.040 * np.sin(Msat - 2 * Mu + deg(6)) + 0.035 * np.sin(Msat - 3 * Mu + deg(33))
+        - 0.015 * np.sin(Mj - Mu + deg(20)))
+    helio = _rectangular(helio_lon, helio_lat, helio_r)
+
+    # سیارات: خورشیدمرکز + بردار زمین‌مرکز خورشید = زمین‌مرکز
+    for name in ('mercury', 'venus', 'mars', 'jupiter', 'saturn', 'uranus', 'neptune'):
+        geo[name] = helio[idx[name]] + sun
+    geo['pluto'] = _pluto_heliocentric(d) + sun
+
+    # انتقال به ناظر روی سطح زمین (Topocentric) در دستگاه استوایی
+    obliquity = np.radians(23.4393 - 3.563e-7 * d)
+    lst = np.radians((280.46061837 + 360.98564736629 * (jd - 2451545.0) + lon) % 360.0)
+    phi = np.radians(lat)
+    # عرض ژئوسنتریک و فاصله از مرکز زمین (بیضوی WGS84، تقریب مرتبه اول)
+    gc_lat = phi - np.radians(0.1924) * np.sin(2 * phi)
+    rho = (0.99833 + 0.00167 * np.cos(2 * phi)) * EARTH_RADIUS_AU
+    obs_eq = np.stack([rho * np.cos(gc_lat) * np.cos(lst),
+                       rho * np.cos(gc_lat) * np.sin(lst),
+                       np.full_like(lst, rho * np.sin(gc_lat))])
+    # چرخش بردار ناظر از استوایی به دایرةالبروجی
+    cos_e, sin_e = np.cos(obliquity), np.sin(obliquity)
+    obs_ecl = np.stack([obs_eq[0],
+                        obs_eq[1] * cos_e + obs_eq[2] * sin_e,
+                        -obs_eq[1] * sin_e + obs_eq[2] * cos_e])
+
+    result: Dict[str, np.ndarray] = {}
+    for name in BODIES:
+        body_lon, _, _ = _spherical(geo[name] - obs_ecl)
+        result[name] = np.degrees(body_lon) % 360.0
+    return result
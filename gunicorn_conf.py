@@ -0,0 +1,20 @@
+# ======================================================================
+# پیکربندی gunicorn برای حالت چند-Worker
+# Master برنامه را یک بار بارگذاری می‌کند (preload_app) تا Kernel نجومی (نگاشت mmap فقط‌خواندنی)
+# و جداول زمانی پیش از Fork ساخته شوند و همه Workerها آن‌ها را Copy-on-Write به اشتراک بگذارند.
+# اجرا: gunicorn -c gunicorn_conf.py bot_app:app
+#
+# تعداد Workerها به طور پیش‌فرض برابر تعداد هسته‌هاست (قابل تغییر با WEB_CONCURRENCY).
+# وضعیت گفتگو، پیام‌های منو و محدودکننده نرخ/Circuit Breaker مکان‌یاب در shared_state (فایل SQLite
+# در STATE_DB_PATH) نگهداری می‌شوند؛ پس آپدیت‌های یک چت می‌توانند به هر Workerی برسند و همه Workerها
+# روی هم حداکثر یک درخواست در ثانیه به Nominatim می‌فرستند.
+# گزارش حافظه هر Worker: GET /admin/memory (با هدر X-Admin-Token)
+# ======================================================================
+
+import os
+import multiprocessing
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8080')}"
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = True
@@ -0,0 +1,101 @@
+# ======================================================================
+# گزارش مصرف حافظه Workerها (حالت چند-Worker با gunicorn --preload)
+# مقادیر از /proc/<pid>/smaps_rollup و /proc/<pid>/smaps خوانده می‌شوند (فقط لینوکس).
+# - rss: حافظه مقیم کل پروسه
+# - pss: سهم منصفانه پروسه (صفحات مشترک بر تعداد پروسه‌های شریک تقسیم می‌شوند)؛
+#   جمع pss همه Workerها مصرف واقعی RAM است.
+# - private: حافظه‌ای که فقط متعلق به همین پروسه است (هزینه افزودن هر Worker جدید)
+# ======================================================================
+
+import os
+from typing import Dict, Any, List, Optional
+
+# فیلدهای smaps (بر حسب kB) که در گزارش آورده می‌شوند
+_SMAPS_FIELDS = {
+    "Rss": "rss_kb",
+    "Pss": "pss_kb",
+    "Shared_Clean": "shared_clean_kb",
+    "Shared_Dirty": "shared_dirty_kb",
+    "Private_Clean": "private_clean_kb",
+    "Private_Dirty": "private_dirty_kb",
+}
+
+
+def _parse_smaps_fields(lines: List[str]) -> Dict[str, int]:
+    """جمع فیلدهای مورد نظر از خطوط smaps."""
+    totals = {name: 0 for name in _SMAPS_FIELDS.values()}
+    for line in lines:
+        key, _, rest = line.partition(":")
+        if key in _SMAPS_FIELDS:
+            totals[_SMAPS_FIELDS[key]] += int(rest.split()[0])
+    return totals
+
+
+def _mapping_usage(pid: int, path_fragment: str) -> Dict[str, int]:
+    """مصرف حافظه نگاشت‌های مربوط به یک فایل (مثلاً Kernel نجومی) در یک پروسه."""
+    selected: List[str] = []
+    in_mapping = False
+    with open(f"/proc/{pid}/smaps") as smaps:
+        for line in smaps:
+            first = line.split(None, 1)[0]
+            if "-" in first and not first.endswith(":"):
+                # سرآیند یک نگاشت جدید: "start-end perms offset dev inode path"
+                in_mapping = line.rstrip().endswith(path_fragment)
+            elif in_mapping:
+                selected.append(line)
+    return _parse_smaps_fields(selected)
+
+
+def process_memory(pid: int, mapped_file: Optional[str] = None) -> Dict[str, Any]:
+    """گزارش حافظه یک پروسه؛ در صورت تعیین mapped_file، سهم نگاشت آن فایل هم آورده می‌شود."""
+    with open(f"/proc/{pid}/smaps_rollup") as rollup:
+        report: Dict[str, Any] = {"pid": pid, **_parse_smaps_fields(rollup.readlines())}
+    report["private_kb"] = report["private_clean_kb"] + report["private_dirty_kb"]
+    if mapped_file:
+        report["mapped_file"] = _mapping_usage(pid, os.path.basename(mapped_file))
+    return report
+
+
+def _is_gunicorn_master(pid: int) -> bool:
+    """آیا پروسه داده شده Master برنامه gunicorn است (بر اساس خط فرمان یا عنوان پروسه)."""
+    try:
+        with open(f"/proc/{pid}/cmdline", "rb") as cmdline:
+            args = cmdline.read().split(b"\0")
+    except OSError:
+        return False
+    return any(b"gunicorn" in os.path.basename(arg) for arg in args[:2])
+
+
+def sibling_worker_pids() -> List[int]:
+    """
+    PID همه Workerهای هم‌سطح (فرزندان Master gunicorn)؛ اگر پروسه والد gunicorn نباشد
+    (مثلاً اجرا با uvicorn از یک Shell) فقط PID جاری، چون فرزندان دیگر والد Worker نیستند.
+    """
+    parent = os.getppid()
+    if not _is_gunicorn_master(parent):
+        return [os.getpid()]
+    try:
+        with open(f"/proc/{parent}/task/{parent}/children") as children:
+            pids = [int(pid) for pid in children.read().split()]
+    except OSError:
+        pids = []
+    return pids if os.getpid() in pids else [os.getpid()]
+
+
+def deployment_report(mapped_file: Optional[str] = None) -> Dict[str, Any]:
+    """گزارش حافظه همه Workerها به همراه جمع کل (جمع pss برابر مصرف واقعی RAM است)."""
+    workers: List[Dict[str, Any]] = []
+    for pid in sibling_worker_pids():
+        try:
+            workers.append(process_memory(pid, mapped_file))
+        except OSError:
+            # Worker در حال راه‌اندازی مجدد است یا /proc در دسترس نیست
+            continue
+    return {
+        "reporting_pid": os.getpid(),
+        "master_pid": os.getppid() if _is_gunicorn_master(os.getppid()) else None,
+        "worker_count": len(workers),
+        "workers": workers,
+        "total_pss_kb": sum(w["pss_kb"] for w in workers),
+        "total_private_kb": sum(w["private_kb"] for w in workers),
+    }
@@ -0,0 +1,159 @@
+# ======================================================================
+# ماژول پروفایلینگ و ردیابی درخواست‌های کند
+# - SamplingProfiler: نمونه‌برداری کم‌هزینه از پشته همه Threadها (حلقه رویداد و Thread Poolها)
+#   و تولید خروجی Collapsed Stacks (قابل استفاده مستقیم در flamegraph.pl یا speedscope).
+# - RequestTrace: زمان‌بندی مرحله‌به‌مرحله هر آپدیت (parse, state, geocode, ephemeris, send)
+#   و ثبت آپدیت‌های کندتر از آستانه در یک Ring Buffer محدود.
+# ======================================================================
+
+import os
+import sys
+import time
+import asyncio
+import threading
+import contextlib
+import contextvars
+from collections import Counter, deque
+from typing import Dict, Any, Optional, List, Deque, Iterator
+
+# ثابت‌ها
+# فاصله نمونه‌برداری (ثانیه)؛ ۱۰ میلی‌ثانیه سربار ناچیزی روی حلقه رویداد دارد.
+PROFILER_SAMPLE_INTERVAL = 0.01
+PROFILER_MAX_SECONDS = 60
+# آستانه ثبت آپدیت کند (میلی‌ثانیه) و اندازه Ring Buffer
+SLOW_REQUEST_THRESHOLD_MS = float(os.environ.get("SLOW_REQUEST_THRESHOLD_MS", "1000"))
+SLOW_REQUEST_BUFFER_SIZE = 200
+
+# --- پروفایلر نمونه‌بردار ---
+
+class SamplingProfiler:
+    """
+    پروفایلر نمونه‌بردار مبتنی بر sys._current_frames().
+    یک Thread پس‌زمینه در فواصل ثابت پشته همه Threadهای دیگر را می‌خواند؛
+    به همین دلیل کد اصلی هیچ Instrumentation یا Hook اضافه‌ای ندارد.
+    """
+
+    def __init__(self, interval: float = PROFILER_SAMPLE_INTERVAL):
+        self.interval = interval
+        self.samples: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        """شروع نمونه‌برداری در یک Thread پس‌زمینه (Daemon)."""
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """توقف نمونه‌برداری و انتظار برای پایان Thread."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self) -> None:
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            thread_names = {t.ident: t.name for t in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                self.samples[self._collapse(thread_names.get(thread_id, str(thread_id)), frame)] += 1
+
+    @staticmethod
+    def _collapse(thread_name: str, frame) -> str:
+        """تبدیل یک Frame به رشته پشته با فرمت collapsed (ریشه در ابتدا، جداشده با ;)."""
+        stack: List[str] = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+            frame = frame.f_back
+        stack.append(thread_name)
+        return ";".join(reversed(stack))
+
+    def collapsed(self) -> str:
+        """خروجی نهایی: هر خط «پشته تعداد»، مرتب شده از داغ‌ترین پشته."""
+        return "\n".join(f"{stack} {count}" for stack, count in self.samples.most_common())
+
+_profile_lock = asyncio.Lock()
+
+async def profile_for(seconds: float) -> Optional[str]:
+    """
+    اجرای پروفایلر برای مدت مشخص بدون مسدود کردن حلقه رویداد.
+    در هر لحظه فقط یک پروفایل اجرا می‌شود؛ اگر پروفایل دیگری در جریان باشد None برمی‌گردد.
+    """
+    if _profile_lock.locked():
+        return None
+    async with _profile_lock:
+        profiler = SamplingProfiler()
+        profiler.start()
+        try:
+            await asyncio.sleep(min(max(seconds, 0.1), PROFILER_MAX_SECONDS))
+        finally:
+            profiler.stop()
+        return profiler.collapsed()
+
+# --- ردیابی درخواست‌های کند ---
+
+class RequestTrace:
+    """زمان‌بندی مراحل پردازش یک آپدیت تلگرام."""
+
+    def __init__(self, update_id: Optional[int] = None):
+        self.update_id = update_id
+        self.chat_id: Optional[int] = None
+        self.started = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+        # مرحله در حال اجرا (برای افزودن به رکوردهای لاگ)
+        self.current_stage: Optional[str] = None
+
+    def add(self, stage_name: str, elapsed_ms: float) -> None:
+        """افزودن زمان یک مرحله (مراحل تکراری مثل چند بار send جمع می‌شوند)."""
+        self.stages[stage_name] = self.stages.get(stage_name, 0.0) + elapsed_ms
+
+    def total_ms(self) -> float:
+        return (time.perf_counter() - self.started) * 1000
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "update_id": self.update_id,
+            "chat_id": self.chat_id,
+            "recorded_at": time.time(),
+            "total_ms": round(self.total_ms(), 2),
+            "stages_ms": {name: round(ms, 2) for name, ms in self.stages.items()},
+        }
+
+# Trace جاری برای هر Task (contextvars در asyncio برای هر درخواست جدا است)
+_current_trace: contextvars.ContextVar[Optional[RequestTrace]] = contextvars.ContextVar("current_trace", default=None)
+SLOW_REQUESTS: Deque[Dict[str, Any]] = deque(maxlen=SLOW_REQUEST_BUFFER_SIZE)
+
+@contextlib.contextmanager
+def trace_request(update_id: Optional[int] = None) -> Iterator[RequestTrace]:
+    """شروع ردیابی یک آپدیت؛ در پایان، اگر کندتر از آستانه بود در SLOW_REQUESTS ثبت می‌شود."""
+    trace = RequestTrace(update_id)
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+        if trace.total_ms() >= SLOW_REQUEST_THRESHOLD_MS:
+            SLOW_REQUESTS.append(trace.to_dict())
+
+def current_trace() -> Optional[RequestTrace]:
+    """Trace آپدیت در حال پردازش (یا None خارج از وب‌هوک)."""
+    return _current_trace.get()
+
+@contextlib.contextmanager
+def stage(stage_name: str) -> Iterator[None]:
+    """اندازه‌گیری زمان یک مرحله؛ خارج از یک Trace فعال، بدون اثر است."""
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+    previous_stage, trace.current_stage = trace.current_stage, stage_name
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add(stage_name, (time.perf_counter() - started) * 1000)
+        trace.current_stage = previous_stage
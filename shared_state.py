@@ -0,0 +1,150 @@
+# ======================================================================
+# ذخیره‌ساز وضعیت مشترک بین Workerها (SQLite محلی)
+# در حالت چند-Worker آپدیت‌های یک چت به پروسه‌های مختلف می‌رسند؛ هر چیزی که باید بین آن‌ها
+# یکسان باشد در این فایل پایگاه داده نگهداری می‌شود:
+# - user_state: مرحله گفتگو و ورودی‌های کاربر (تاریخ، ساعت، شهر)
+# - menu_messages: پیام‌های منوی ربات و هش آخرین محتوای رندر شده (ویرایش درجا)
+# - geocoder: مالک واحد محدودیت نرخ Nominatim (نوبت بعدی) و Circuit Breaker مشترک
+#
+# هر پروسه اتصال خودش را (پس از Fork، به صورت Lazy) باز می‌کند. با WAL و synchronous=NORMAL
+# هر تراکنش کوتاه در حد میکروثانیه است و روی حلقه رویداد مستقیماً اجرا می‌شود.
+# فایل باید روی دیسک محلی همان میزبان باشد؛ Workerهای چند میزبان به Redis یا مشابه آن نیاز دارند.
+# ======================================================================
+
+import os
+import json
+import time
+import sqlite3
+from typing import Dict, Any, Optional, Tuple
+
+# مسیر فایل پایگاه داده (قابل تغییر با متغیر محیطی STATE_DB_PATH)
+STATE_DB_PATH = os.environ.get("STATE_DB_PATH", "bot_state.sqlite3")
+# حداکثر زمان انتظار برای قفل نوشتن پروسه‌های دیگر (ثانیه)
+STATE_DB_BUSY_TIMEOUT = 1.0
+# حداکثر تعداد پیام‌های منوی نگهداری شده (قدیمی‌ترین‌ها حذف می‌شوند)
+MENU_MESSAGES_MAX_ROWS = 10000
+# هر چند ثبت منو یک بار جدول هرس شود
+MENU_PRUNE_EVERY = 100
+# نوبت ذخیره شده دورتر از این (ثانیه) نشانه تغییر ساعت سیستم است و نادیده گرفته می‌شود
+GEOCODER_MAX_SLOT_AHEAD = 3600.0
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS user_state (
+    chat_id INTEGER PRIMARY KEY,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS menu_messages (
+    chat_id INTEGER NOT NULL,
+    message_id INTEGER NOT NULL,
+    content_hash TEXT,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (chat_id, message_id)
+);
+CREATE INDEX IF NOT EXISTS menu_messages_updated_at ON menu_messages (updated_at);
+CREATE TABLE IF NOT EXISTS geocoder (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    next_slot REAL NOT NULL,
+    failures INTEGER NOT NULL,
+    breaker_open_until REAL NOT NULL
+);
+INSERT OR IGNORE INTO geocoder (id, next_slot, failures, breaker_open_until) VALUES (0, 0, 0, 0);
+"""
+
+_connection: Optional[sqlite3.Connection] = None
+_connection_pid: Optional[int] = None
+_menu_writes = 0
+
+
+def _db() -> sqlite3.Connection:
+    """اتصال پروسه جاری؛ اتصال به ارث رسیده از Master (پس از Fork) هرگز استفاده نمی‌شود."""
+    global _connection, _connection_pid
+    if _connection is None or _connection_pid != os.getpid():
+        # isolation_level=None: تراکنش‌ها صریحاً با BEGIN IMMEDIATE شروع می‌شوند
+        connection = sqlite3.connect(STATE_DB_PATH, timeout=STATE_DB_BUSY_TIMEOUT, isolation_level=None)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.executescript(_SCHEMA)
+        _connection, _connection_pid = connection, os.getpid()
+    return _connection
+
+# --- وضعیت گفتگو ---
+
+def load_user_state(chat_id: int) -> Optional[Dict[str, Any]]:
+    """وضعیت ذخیره شده یک چت (مقادیر قابل سریال‌سازی JSON) یا None."""
+    row = _db().execute("SELECT data FROM user_state WHERE chat_id = ?", (chat_id,)).fetchone()
+    return json.loads(row[0]) if row else None
+
+
+def save_user_state(chat_id: int, data: Dict[str, Any]) -> None:
+    """ذخیره وضعیت یک چت (جایگزین مقدار قبلی)."""
+    _db().execute("INSERT OR REPLACE INTO user_state (chat_id, data) VALUES (?, ?)",
+                  (chat_id, json.dumps(data, ensure_ascii=False)))
+
+# --- پیام‌های منو ---
+
+def get_menu_message(chat_id: int, message_id: int) -> Tuple[bool, Optional[str]]:
+    """(آیا پیام یک منوی ثبت شده است، هش آخرین محتوای رندر شده یا None اگر نامعلوم باشد)."""
+    row = _db().execute("SELECT content_hash FROM menu_messages WHERE chat_id = ? AND message_id = ?",
+                        (chat_id, message_id)).fetchone()
+    return (True, row[0]) if row else (False, None)
+
+
+def remember_menu_message(chat_id: int, message_id: int, content_hash: Optional[str]) -> None:
+    """ثبت یا به‌روزرسانی یک پیام منو؛ جدول هر MENU_PRUNE_EVERY بار هرس می‌شود."""
+    global _menu_writes
+    db = _db()
+    db.execute("INSERT OR REPLACE INTO menu_messages (chat_id, message_id, content_hash, updated_at) VALUES (?, ?, ?, ?)",
+               (chat_id, message_id, content_hash, time.time()))
+    _menu_writes += 1
+    if _menu_writes % MENU_PRUNE_EVERY == 0:
+        db.execute("DELETE FROM menu_messages WHERE updated_at < "
+                   "(SELECT updated_at FROM menu_messages ORDER BY updated_at DESC LIMIT 1 OFFSET ?)",
+                   (MENU_MESSAGES_MAX_ROWS - 1,))
+
+
+def forget_menu_message(chat_id: int, message_id: int) -> None:
+    """حذف یک پیام از منوهای ثبت شده."""
+    _db().execute("DELETE FROM menu_messages WHERE chat_id = ? AND message_id = ?", (chat_id, message_id))
+
+# --- محدودیت نرخ و Circuit Breaker مکان‌یاب ---
+
+def reserve_geocoder_slot(min_interval: float, max_wait: float) -> Optional[float]:
+    """
+    رزرو نوبت بعدی درخواست Nominatim برای همه Workerها (ترتیب رزرو = ترتیب ارسال).
+    خروجی: زمان انتظار تا نوبت رزرو شده (ثانیه)، یا None اگر صف بیش از max_wait جلوتر باشد.
+    """
+    db = _db()
+    # with: در پایان COMMIT و در صورت خطا ROLLBACK؛ IMMEDIATE قفل نوشتن را از ابتدا می‌گیرد
+    with db:
+        db.execute("BEGIN IMMEDIATE")
+        now = time.time()
+        next_slot = db.execute("SELECT next_slot FROM geocoder WHERE id = 0").fetchone()[0]
+        if next_slot - now > GEOCODER_MAX_SLOT_AHEAD:
+            # نوبت ذخیره شده پس از عقب رفتن ساعت سیستم بی‌معنی است
+            next_slot = now
+        slot = max(now, next_slot)
+        if slot - now > max_wait:
+            return None
+        db.execute("UPDATE geocoder SET next_slot = ? WHERE id = 0", (slot + min_interval,))
+    return slot - now
+
+
+def geocoder_breaker_open_until() -> float:
+    """زمان (Unix) بسته شدن Circuit Breaker مشترک."""
+    return _db().execute("SELECT breaker_open_until FROM geocoder WHERE id = 0").fetchone()[0]
+
+
+def record_geocoder_result(success: bool, threshold: int, cooldown: float) -> None:
+    """شمارش خطاهای پیاپی همه Workerها و باز کردن Breaker پس از threshold خطا."""
+    db = _db()
+    if success:
+        db.execute("UPDATE geocoder SET failures = 0 WHERE id = 0 AND failures != 0")
+        return
+    with db:
+        db.execute("BEGIN IMMEDIATE")
+        failures = db.execute("SELECT failures FROM geocoder WHERE id = 0").fetchone()[0] + 1
+        if failures >= threshold:
+            db.execute("UPDATE geocoder SET failures = 0, breaker_open_until = ? WHERE id = 0",
+                       (time.time() + cooldown,))
+        else:
+            db.execute("UPDATE geocoder SET failures = ? WHERE id = 0", (failures,))
@@ -0,0 +1,55 @@
+# ======================================================================
+# تست اعتبارسنجی موتور سریع در برابر مسیر دقیق Skyfield
+# از Kernelهای آزمایشی همراه Skyfield استفاده می‌شود (بدون دانلود)؛ هر کدام فقط چند روز را
+# پوشش می‌دهند، پس زمان‌ها در محدوده پوشش Segment زمین و ماه همان Kernel انتخاب شده‌اند.
+# اجرا: python -m pytest -q test_fast_ephemeris.py
+# ======================================================================
+
+import os
+import datetime
+
+import pytest
+
+skyfield = pytest.importorskip("skyfield")
+from skyfield.api import load_file
+
+KERNEL_DIR = os.path.join(os.path.dirname(skyfield.__file__), "tests", "data")
+
+# جلوگیری از تلاش برای دانلود de421.bsp هنگام import ماژول astrology_core
+os.environ.setdefault("EPHEMERIS_FILE", os.path.join(KERNEL_DIR, "de430-2015-03-02.bsp"))
+
+import astrology_core
+import fast_ephemeris
+
+# (فایل Kernel، شروع بازه، تعداد نمونه‌های سه ساعته)
+KERNEL_WINDOWS = [
+    ("de430-2015-03-02.bsp", datetime.datetime(2015, 2, 28, tzinfo=datetime.timezone.utc), 48),
+    ("de441-1969.bsp", datetime.datetime(1969, 7, 26, 12, tzinfo=datetime.timezone.utc), 24),
+]
+
+# تهران، سیدنی، ریکیاویک
+OBSERVERS = [(35.7, 51.4), (-33.9, 151.2), (64.1, -21.9)]
+
+
+@pytest.mark.parametrize("kernel_name, start, samples", KERNEL_WINDOWS)
+def test_fast_engine_within_documented_bound(monkeypatch, kernel_name, start, samples):
+    kernel_path = os.path.join(KERNEL_DIR, kernel_name)
+    if not os.path.exists(kernel_path):
+        pytest.skip(f"{kernel_name} is not bundled with this Skyfield version")
+    monkeypatch.setattr(astrology_core, "EPHEMERIS", load_file(kernel_path))
+
+    times_utc = [start + datetime.timedelta(hours=3 * i) for i in range(samples)]
+    for lat, lon in OBSERVERS:
+        errors = astrology_core.validate_fast_engine(times_utc, lat, lon)
+        assert set(errors) == set(astrology_core.PLANETS)
+        worst = max(errors, key=errors.get)
+        assert errors[worst] < fast_ephemeris.FAST_ENGINE_MAX_ERROR_DEG, (worst, errors[worst])
+
+
+def test_fast_chart_outside_validated_range_uses_precise_engine(monkeypatch):
+    calls = []
+    monkeypatch.setattr(astrology_core, "calculate_natal_chart",
+                        lambda birth_time_utc, lat, lon, engine: calls.append(engine) or {})
+    birth_time_utc = datetime.datetime(fast_ephemeris.FAST_ENGINE_MAX_YEAR + 1, 1, 1, tzinfo=datetime.timezone.utc)
+    astrology_core.calculate_fast_chart(birth_time_utc, 35.7, 51.4)
+    assert calls == [astrology_core.ENGINE_PRECISE]
@@ -1,27 +1,59 @@
 # ======================================================================
 # ماژول Utility Functions
 # شامل توابع کمکی برای ارتباط با تلگرام، پارس تاریخ، و جغرافیایی (Geocoding).
-# از httpx و client.to_thread.run_sync() برای جلوگیری از Blocking I/O استفاده می‌کند.
+# تمام I/O (تلگرام و Nominatim) به صورت آسنکرون روی کلاینت مشترک httpx انجام می‌شود.
 # ======================================================================
 
 import httpx
+import asyncio
 import datetime
+import time
+import unicodedata
 import pytz
 from persiantools.jdatetime import JalaliDateTime
-from geopy.geocoders import Nominatim
-from geopy.location import Location
 from typing import Optional, Tuple, Dict, Any, Callable
+import hashlib
+import json
 import re
 
+import profiling
+import shared_state
+from app_logging import get_logger
+
+logger = get_logger(__name__)
+
 # ثابت‌ها
 TELEGRAM_API_BASE = "https://api.telegram.org/bot"
 NOMINATIN_USER_AGENT = "mehrozkiyad_astrology_bot"
+NOMINATIM_SEARCH_URL = "https://nominatim.openstreetmap.org/search"
+
+# سیاست استفاده Nominatim: حداکثر یک درخواست در ثانیه
+NOMINATIM_MIN_INTERVAL = 1.0
+# مهلت زمانی خود درخواست HTTP
+GEOCODE_REQUEST_TIMEOUT = 5.0
+# حداکثر تعداد نوبت‌های رزرو شده جلوتر در صف محدودکننده نرخ (مشترک بین همه Workerها)؛
+# هندلر وب‌هوک منتظر جستجو است، پس به جای انتظار طولانی سریعاً «سرویس در دسترس نیست» برمی‌گردانیم.
+GEOCODE_MAX_QUEUE = 3
+# Circuit Breaker: پس از این تعداد خطای پیاپی، برای مدت مشخص درخواستی ارسال نمی‌شود
+GEOCODE_BREAKER_THRESHOLD = 3
+GEOCODE_BREAKER_COOLDOWN = 30.0
 
 # کلاینت HTTP آسنکرون (برای استفاده در bot_app)
 client = httpx.AsyncClient()
 
-# سرویس مکان‌یابی (به دلیل Blocking بودن، باید در thread اجرا شود)
-geolocator = Nominatim(user_agent=NOMINATIN_USER_AGENT)
+# پیام‌های منوی ربات و هش آخرین محتوای رندر شده هرکدام در shared_state (مشترک بین Workerها) هستند.
+# فقط این پیام‌ها درجا ویرایش می‌شوند (مثلاً خلاصه چارت هرگز با منو جایگزین نمی‌شود)،
+# و اگر منوی مقصد از قبل نمایش داده شده باشد editMessageText فراخوانی نمی‌شود.
+
+# --- وضعیت مکان‌یاب آسنکرون ---
+# نوبت‌دهی محدودیت نرخ و Circuit Breaker در shared_state هستند تا همه Workerها روی هم
+# حداکثر یک درخواست در ثانیه بفرستند. ادغام جستجوهای همزمان یکسان در هر پروسه انجام می‌شود:
+# درخواست‌های در جریان بر اساس نام نرمال‌شده
+_geocode_inflight: Dict[str, "asyncio.Future[Tuple[Optional[float], Optional[float]]]"] = {}
+
+
+class GeocodingUnavailableError(Exception):
+    """سرویس مکان‌یابی موقتاً در دسترس نیست (Circuit Breaker باز، صف پر، Timeout یا خطای HTTP)."""
 
 # --- توابع کمکی ---
 
@@ -38,8 +70,11 @@ def escape_markdown_v2(text: str) -> str:
 
 # --- توابع ارتباطی تلگرام ---
 
-async def send_message(bot_token: str, chat_id: int, text: str, reply_markup: Optional[Dict[str, Any]] = None) -> None:
-    """ارسال پیام به تلگرام به صورت آسنکرون با استفاده از MarkdownV2."""
+async def send_message(bot_token: str, chat_id: int, text: str, reply_markup: Optional[Dict[str, Any]] = None) -> Optional[int]:
+    """
+    ارسال پیام به تلگرام به صورت آسنکرون با استفاده از MarkdownV2.
+    خروجی: message_id پیام ارسال شده (یا None در صورت خطا).
+    """
     url = f"{TELEGRAM_API_BASE}{bot_token}/sendMessage"
     
     # اطمینان از Escape شدن متن برای سازگاری کامل با MarkdownV2
@@ -55,13 +90,118 @@ async def send_message(bot_token: str, chat_id: int, text: str, reply_markup: Op
     
     try:
         # ارسال آسنکرون
-        response = await client.post(url, json=payload, timeout=10)
+        with profiling.stage("send"):
+            response = await client.post(url, json=payload, timeout=10)
         response.raise_for_status() # بررسی خطاهای HTTP مانند 4xx/5xx
+        return response.json().get("result", {}).get("message_id")
     except httpx.HTTPError as e:
         # خطای رایج: متن Escape نشده یا طولانی است.
-        print(f"HTTP error sending message: {e}. Response content: {getattr(e.response, 'text', 'N/A')}")
-    except Exception as e:
-        print(f"Unexpected error sending message: {e}")
+        _log_telegram_error(e, "sendMessage")
+    except Exception:
+        logger.exception("Unexpected error sending message")
+    return None
+
+def _log_telegram_error(error: httpx.HTTPError, method: str) -> None:
+    """
+    ثبت خطای HTTP تلگرام با متد، کد وضعیت و توضیح پاسخ (یا نوع خطا برای Timeout/شبکه).
+    str(error) عمداً ثبت نمی‌شود: آدرس درخواست شامل توکن ربات است.
+    """
+    response = error.response if isinstance(error, httpx.HTTPStatusError) else None
+    status = response.status_code if response is not None else None
+    description = type(error).__name__
+    if response is not None:
+        try:
+            body = response.json()
+        except ValueError:
+            body = None
+        description = body.get("description", description) if isinstance(body, dict) else description
+    logger.warning("Telegram API error in %s: status=%s %s", method, status, description,
+                   extra={"api_method": method, "status": status, "description": description})
+
+# نتیجه editMessageText برای تصمیم‌گیری فراخوان
+EDIT_OK = "ok"                    # پیام اکنون محتوای خواسته شده را نمایش می‌دهد
+EDIT_NOT_EDITABLE = "not_editable"  # تلگرام اعلام کرد پیام پیدا نشد یا قابل ویرایش نیست
+EDIT_FAILED = "failed"            # خطای گذرا (429، 5xx، Timeout، شبکه)؛ ممکن است ویرایش انجام شده باشد
+
+# پاسخ‌های 400 تلگرام که یعنی ویرایش این پیام هرگز ممکن نیست و باید پیام جدید ارسال شود
+_NOT_EDITABLE_ERRORS = (
+    "message to edit not found",
+    "message can't be edited",
+    "message_id_invalid",
+    "there is no text in the message to edit",
+)
+
+def _content_hash(text: str, reply_markup: Optional[Dict[str, Any]]) -> str:
+    """محاسبه هش پایدار از متن و کیبورد یک پیام (برای تشخیص محتوای بدون تغییر)."""
+    raw = json.dumps([text, reply_markup], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+def is_menu_message(chat_id: int, message_id: int) -> bool:
+    """آیا این پیام یک منوی ثبت شده ربات است (و ویرایش درجای آن مجاز است)."""
+    return shared_state.get_menu_message(chat_id, message_id)[0]
+
+def remember_menu_message(chat_id: int, message_id: int, text: str, reply_markup: Optional[Dict[str, Any]]) -> None:
+    """ثبت یک پیام تازه ارسال شده به عنوان منو به همراه محتوای آن."""
+    _remember_rendered(chat_id, message_id, _content_hash(text, reply_markup))
+
+def _remember_rendered(chat_id: int, message_id: int, content_hash: Optional[str]) -> None:
+    """ثبت هش آخرین محتوای نمایش داده شده برای یک پیام منو (None: محتوا نامعلوم)."""
+    shared_state.remember_menu_message(chat_id, message_id, content_hash)
+
+def forget_rendered(chat_id: int, message_id: int) -> None:
+    """حذف یک پیام از منوهای ثبت شده (مثلاً وقتی تلگرام اعلام کند پیام دیگر قابل ویرایش نیست)."""
+    shared_state.forget_menu_message(chat_id, message_id)
+
+async def edit_message(bot_token: str, chat_id: int, message_id: int, text: str, reply_markup: Optional[Dict[str, Any]] = None) -> str:
+    """
+    ویرایش درجای پیام قبلی (editMessageText) به جای ارسال پیام جدید.
+    اگر محتوای مقصد (متن + کیبورد) از قبل روی همین پیام نمایش داده شده باشد،
+    هیچ درخواستی به API ارسال نمی‌شود.
+
+    خروجی: یکی از EDIT_OK، EDIT_NOT_EDITABLE یا EDIT_FAILED. فقط در حالت EDIT_NOT_EDITABLE
+    ارسال پیام جدید امن است؛ در حالت EDIT_FAILED ارسال مجدد ممکن است طوفان 429 را تشدید
+    کند یا (پس از Timeout) منوی تکراری بسازد.
+    """
+    content_hash = _content_hash(text, reply_markup)
+    if shared_state.get_menu_message(chat_id, message_id)[1] == content_hash:
+        return EDIT_OK
+
+    url = f"{TELEGRAM_API_BASE}{bot_token}/editMessageText"
+    payload = {
+        "chat_id": chat_id,
+        "message_id": message_id,
+        "text": escape_markdown_v2(text),
+        "parse_mode": "MarkdownV2",
+    }
+    if reply_markup:
+        payload["reply_markup"] = reply_markup
+
+    try:
+        with profiling.stage("send"):
+            response = await client.post(url, json=payload, timeout=10)
+        if response.status_code == 400:
+            description = response.text.lower()
+            if "message is not modified" in description:
+                # پیام از قبل همین محتوا را دارد (مثلاً پس از ری‌استارت و خالی شدن کش)
+                _remember_rendered(chat_id, message_id, content_hash)
+                return EDIT_OK
+            if any(error in description for error in _NOT_EDITABLE_ERRORS):
+                forget_rendered(chat_id, message_id)
+                logger.info("Message not editable, falling back to sendMessage", extra={"api_method": "editMessageText"})
+                return EDIT_NOT_EDITABLE
+        response.raise_for_status()
+    except httpx.HTTPError as e:
+        # 429، 5xx، Timeout یا خطای شبکه: محتوای پیام نامعلوم است ولی همچنان یک منو است
+        _remember_rendered(chat_id, message_id, None)
+        _log_telegram_error(e, "editMessageText")
+        return EDIT_FAILED
+    except Exception:
+        _remember_rendered(chat_id, message_id, None)
+        logger.exception("Unexpected error editing message")
+        return EDIT_FAILED
+
+    _remember_rendered(chat_id, message_id, content_hash)
+    return EDIT_OK
 
 async def answer_callback_query(bot_token: str, callback_query_id: str, text: Optional[str] = None) -> None:
     """پاسخ به Callback Query (برای حذف ساعت چرخان Loading یا نمایش پیام)."""
@@ -76,11 +216,12 @@ async def answer_callback_query(bot_token: str, callback_query_id: str, text: Op
         
     try:
         # ارسال آسنکرون
-        await client.post(url, json=payload, timeout=5)
+        with profiling.stage("send"):
+            await client.post(url, json=payload, timeout=5)
     except httpx.HTTPError as e:
-        print(f"HTTP error answering callback: {e}")
-    except Exception as e:
-        print(f"Unexpected error answering callback: {e}")
+        _log_telegram_error(e, "answerCallbackQuery")
+    except Exception:
+        logger.exception("Unexpected error answering callback")
 
 # --- توابع پارس تاریخ و زمان ---
 
@@ -125,27 +266,91 @@ def find_timezone(city_name: str) -> Optional[pytz.tzinfo.BaseTzInfo]:
 
 # --- توابع جغرافیایی (Geocoding) ---
 
+def normalize_city_name(city_name: str) -> str:
+    """نرمال‌سازی نام شهر برای ادغام درخواست‌ها (یکسان‌سازی ی/ک عربی، فاصله‌ها و حروف)."""
+    name = unicodedata.normalize("NFKC", city_name)
+    name = name.replace("ي", "ی").replace("ك", "ک").replace("\u200c", " ")
+    return " ".join(name.split()).casefold()
+
+def _record_geocode_result(success: bool) -> None:
+    """به‌روزرسانی وضعیت Circuit Breaker مشترک پس از هر درخواست."""
+    shared_state.record_geocoder_result(success, GEOCODE_BREAKER_THRESHOLD, GEOCODE_BREAKER_COOLDOWN)
+
+def _geocode_circuit_open(query: str) -> bool:
+    """آیا Circuit Breaker باز است (در این صورت جستجو بدون تماس با Nominatim شکست می‌خورد)."""
+    if time.time() < shared_state.geocoder_breaker_open_until():
+        logger.info("Geocoding circuit open, skipping lookup", extra={"city": query, "sample_rate": 0.1})
+        return True
+    return False
+
+async def _nominatim_search(query: str) -> Tuple[Optional[float], Optional[float]]:
+    """
+    یک جستجوی Nominatim با رعایت محدودیت نرخ، مهلت زمانی و Circuit Breaker.
+    خروجی (None, None) یعنی شهر پیدا نشد؛ هر خرابی سرویس GeocodingUnavailableError است.
+    """
+    if _geocode_circuit_open(query):
+        raise GeocodingUnavailableError("circuit open")
+
+    # رزرو نوبت در صف منصفانه مشترک (حداقل یک ثانیه بین درخواست‌های همه Workerها)
+    delay = shared_state.reserve_geocoder_slot(NOMINATIM_MIN_INTERVAL, GEOCODE_MAX_QUEUE * NOMINATIM_MIN_INTERVAL)
+    if delay is None:
+        logger.warning("Geocoding queue full, rejecting lookup", extra={"city": query})
+        raise GeocodingUnavailableError("queue full")
+    await asyncio.sleep(delay)
+
+    # ممکن است Circuit Breaker در مدتی که این درخواست در صف بود باز شده باشد
+    if _geocode_circuit_open(query):
+        raise GeocodingUnavailableError("circuit open")
+
+    params = {"q": query, "format": "jsonv2", "limit": 1}
+    headers = {"User-Agent": NOMINATIN_USER_AGENT}
+    try:
+        response = await client.get(NOMINATIM_SEARCH_URL, params=params, headers=headers, timeout=GEOCODE_REQUEST_TIMEOUT)
+        response.raise_for_status()
+        results = response.json()
+        coords = (float(results[0]["lat"]), float(results[0]["lon"])) if results else (None, None)
+    except (httpx.HTTPError, ValueError, KeyError, IndexError, TypeError) as e:
+        # خطاهایی مانند Timeout، مشکل شبکه، 429/5xx یا پاسخ نامعتبر
+        _record_geocode_result(False)
+        logger.warning("Geocoding error for %s: %s", query, e, extra={"city": query})
+        raise GeocodingUnavailableError(type(e).__name__) from e
+
+    _record_geocode_result(True)
+    return coords
+
+def _finish_inflight(key: str, future: "asyncio.Future[Tuple[Optional[float], Optional[float]]]") -> None:
+    """حذف جستجوی تمام شده از ادغام؛ خطا علامت‌گذاری می‌شود تا اگر همه منتظران لغو شده باشند هشدار asyncio ندهد."""
+    _geocode_inflight.pop(key, None)
+    if not future.cancelled():
+        future.exception()
+
+async def geocode_city(city_name: str) -> Tuple[Optional[float], Optional[float]]:
+    """
+    دریافت مختصات شهر به صورت آسنکرون.
+    جستجوهای همزمان برای یک نام نرمال‌شده در یک درخواست واحد ادغام می‌شوند.
+    در صورت در دسترس نبودن سرویس GeocodingUnavailableError رخ می‌دهد.
+    """
+    key = normalize_city_name(city_name)
+    if not key:
+        return None, None
+
+    future = _geocode_inflight.get(key)
+    if future is None:
+        future = asyncio.ensure_future(_nominatim_search(city_name.strip()))
+        _geocode_inflight[key] = future
+        future.add_done_callback(lambda _f: _finish_inflight(key, _f))
+
+    # shield: لغو شدن یک منتظر، درخواست مشترک سایر منتظران را لغو نمی‌کند
+    return await asyncio.shield(future)
+
 async def get_coordinates_from_city(city_name: str) -> Tuple[Optional[float], Optional[float], Optional[pytz.tzinfo.BaseTzInfo]]:
     """
     دریافت مختصات جغرافیایی (Lat/Lon) و منطقه زمانی (TimeZone) از نام شهر.
-    این عملیات مسدودکننده (Blocking) است و در یک Thread جداگانه اجرا می‌شود.
+    جستجو به صورت آسنکرون روی Connection Pool مشترک httpx انجام می‌شود (بدون Thread).
+    اگر شهر پیدا نشود lat/lon برابر None است؛ خرابی سرویس به صورت GeocodingUnavailableError منتشر می‌شود.
     """
-    
-    def blocking_geocode() -> Tuple[Optional[float], Optional[float]]:
-        """عملیات Geocoding مسدودکننده با geopy."""
-        try:
-            # مهلت زمانی (Timeout) برای جلوگیری از مسدود شدن طولانی
-            location: Optional[Location] = geolocator.geocode(city_name, timeout=5)
-            if location:
-                return location.latitude, location.longitude
-            return None, None
-        except Exception as e:
-            # خطاهایی مانند Timeout یا مشکل در شبکه
-            print(f"Geocoding error for {city_name}: {e}")
-            return None, None
-
-    # اجرای تابع مسدودکننده در یک thread جداگانه (حل مشکل Blocking I/O در Async)
-    lat, lon = await client.to_thread.run_sync(blocking_geocode)
+    with profiling.stage("geocode"):
+        lat, lon = await geocode_city(city_name)
     
     # پیدا کردن منطقه زمانی (بر اساس نام شهر، نه مختصات)
     tz = find_timezone(city_name)